@@ -1,57 +1,60 @@
 import re
-from typing import Optional, Dict, Any
+from functools import lru_cache
+from typing import Optional, Dict, Any, Callable, Sequence, Tuple
 import pandas as pd
 
-BANNED_TOKENS = {
+BANNED_TOKENS = frozenset({
     "MONITOR","DISPLAY","WINDOWS","SERVER","STANDARD","MICROSOFT","ASUS","LENOVO","HPE","HP",
     "INTEL","NVIDIA","RYZEN","GEFORCE","CORE","DDR","DDR4","DDR5","UHD","FHD","IPS","VA","TN",
     "DOS","ENG","ENGLISH","NEW","AIO","PCS","WORKSTATION","NOTEBOOK","LAPTOP","WUE","G5","G9",
     "BACKLIT","KEYBOARD","MOUSE","WIFI","BT","BLUETOOTH","PCIe","NVME","SSD","HDD","GB","TB",
     "INCH","WARRANTY","YRS","3YRS","1YW","AX","TNR","ID","FLEX","SLOT","HOT","PLUG","LOW",
     "HALOGEN","KIT","POWER","SUPPLY","TITANIUM","PRO","HOME","BUSINESS","STANDARD","LOQ"
-}
+})
+
+# Regexes are compiled once here instead of going through re's cache per row
+_RE_PAREN = re.compile(r"\(([^\)]+)\)")
+_RE_NOT_ID_CHAR = re.compile(r"[^A-Z0-9#\-]")
+_RE_HPMON = re.compile(r"\b[0-9A-Z]{5,}(?:#[0-9A-Z]{2,})\b")
+_RE_NOT_TOKEN_CHAR = re.compile(r"[^A-Z0-9\-\s]")
+_RE_DELLMODEL = re.compile(r"\b[A-Z0-9]{5,}\b")
+# Token with at least one letter and one digit (so never all digits)
+_RE_TOKEN_OK = re.compile(r"^(?=.*[A-Z])(?=.*\d)[A-Z0-9]{5,}$")
+_RE_YRS = re.compile(r"^\d{1,2}YRS$")
 
 def _clean_caps(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "")).strip().upper()
+    return " ".join((s or "").split()).upper()
 
-def _find_parenthetical_id(text: str) -> Optional[str]:
-    s = _clean_caps(text)
-    m = re.search(r"\(([^\)]+)\)", s)
+# The _find_* helpers expect text already normalized by _clean_caps, so a
+# description is cleaned once per row rather than once per helper.
+def _find_parenthetical_id(s: str) -> Optional[str]:
+    m = _RE_PAREN.search(s)
     if not m:
         return None
-    cand = re.sub(r"[^A-Z0-9#\-]", "", m.group(1))
-    if len(re.sub(r"[^A-Z0-9]", "", cand)) < 5:
+    cand = _RE_NOT_ID_CHAR.sub("", m.group(1))
+    # cand only holds A-Z, 0-9, '#' and '-', so count alphanumerics directly
+    if len(cand) - cand.count("#") - cand.count("-") < 5:
         return None
     return cand
 
-def _find_hp_monitor_id(text: str) -> Optional[str]:
-    s = _clean_caps(text)
-    m = re.search(r"\b[0-9A-Z]{5,}(?:#[0-9A-Z]{2,})\b", s)
+def _find_hp_monitor_id(s: str) -> Optional[str]:
+    m = _RE_HPMON.search(s)
     return m.group(0) if m else None
 
-def _find_dell_model_like(text: str) -> Optional[str]:
-    s = _clean_caps(text)
-    s = re.sub(r"[^A-Z0-9\-\s]", " ", s)
-    tokens = re.findall(r"\b[A-Z0-9]{5,}\b", s)
-    filtered = []
-    for t in tokens:
-        if t.isdigit():
+def _find_dell_model_like(s: str) -> Optional[str]:
+    s = _RE_NOT_TOKEN_CHAR.sub(" ", s)
+    tokens = _RE_DELLMODEL.findall(s)
+    # Last usable token wins, preferring ones starting with P/U/S/E/A; scan
+    # from the end so the first preferred hit can return early
+    fallback = None
+    for t in reversed(tokens):
+        if t in BANNED_TOKENS or not _RE_TOKEN_OK.match(t) or _RE_YRS.match(t):
             continue
-        if t in BANNED_TOKENS:
-            continue
-        if re.match(r"^\d{3,}$", t):
-            continue
-        if re.match(r"^\d{1,2}YRS$", t):
-            continue
-        has_letter = bool(re.search(r"[A-Z]", t))
-        has_digit = bool(re.search(r"\d", t))
-        if not (has_letter and has_digit):
-            continue
-        filtered.append(t)
-    if not filtered:
-        return None
-    preferred = [t for t in filtered if t[0] in ("P","U","S","E","A")]
-    return preferred[-1] if preferred else filtered[-1]
+        if t[0] in ("P","U","S","E","A"):
+            return t
+        if fallback is None:
+            fallback = t
+    return fallback
 
 def _phrase_before_first_comma(text: str) -> Optional[str]:
     if not text:
@@ -59,115 +62,176 @@ def _phrase_before_first_comma(text: str) -> Optional[str]:
     head = text.split(",")[0].strip()
     return head or None
 
-def _generic_from_description(text: str) -> Optional[str]:
+def _generic_from_description(s: str) -> Optional[str]:
     return (
-        _find_parenthetical_id(text)
-        or _find_hp_monitor_id(text)
-        or _find_dell_model_like(text)
+        _find_parenthetical_id(s)
+        or _find_hp_monitor_id(s)
+        or _find_dell_model_like(s)
     )
 
-def extract_product_id_for_row(sheet_name: str, row: Dict[str, Any]) -> Optional[str]:
-    sname = _clean_caps(sheet_name)
-    # Best-effort to find common columns or positional cells
+@lru_cache(maxsize=256)
+def _resolve_columns(columns: Tuple[Any, ...]) -> Tuple[Optional[int], Optional[int], Optional[int]]:
+    # Best-effort to find common columns or positional cells; resolved once
+    # per header layout and returned as positions into each row tuple
     desc = None
     part = None
     ref = None
 
     # Try common label variants
-    for k in row.keys():
+    for i, k in enumerate(columns):
         ku = _clean_caps(str(k))
         if ku in ("DESCRIPTION",):
-            desc = row[k]
+            desc = i
         elif ku in ("PART NUMBER","PART","PART NO","P/N"):
-            part = row[k]
+            part = i
         elif ku in ("REF","REFERENCE"):
-            ref = row[k]
+            ref = i
         elif ku in ("UNIT PRICE /JAFZ","UNIT PRICE/JAFZ","UNIT PRICE","PRICE"):
             # cost handled outside; keep here if needed
             pass
 
     # Fallbacks for headerless rows: take first/second cells by index
     if desc is None:
-        if 0 in row:
-            desc = row[0]
-        else:
-            # Try the first key by order if it looks like description text
-            try:
-                first_key = list(row.keys())[0]
-                desc = row[first_key]
-            except Exception:
-                desc = None
-    if part is None and 1 in row:
-        part = row[1]
-    if ref is None and "REF" in row:
-        ref = row["REF"]
+        if 0 in columns:
+            desc = columns.index(0)
+        elif columns:
+            # Try the first column by order if it looks like description text
+            desc = 0
+    if part is None and 1 in columns:
+        part = columns.index(1)
+    if ref is None and "REF" in columns:
+        ref = columns.index("REF")
+    return desc, part, ref
+
+def _text(value: Any) -> str:
+    return str(value or "").strip()
+
+def _cell(values: Sequence[Any], idx: Optional[int]) -> str:
+    return _text(values[idx]) if idx is not None else ""
+
+# Per-sheet extraction strategies: each takes the stripped description,
+# part number and ref cells of one row
+def _extract_ups(desc: str, part: str, ref: str) -> Optional[str]:
+    # UPS: product id from ref
+    return ref or None
 
-    desc = str(desc or "").strip()
-    part = str(part or "").strip()
-    ref = str(ref or "").strip()
+def _extract_microsoft_asus(desc: str, part: str, ref: str) -> Optional[str]:
+    # Microsoft & ASUS: prefer description, else part number
+    return _generic_from_description(_clean_caps(desc)) or (part if part and part.upper() != "NEW" else None)
 
-    # UPS: product id from ref
+def _extract_desc_then_part(desc: str, part: str, ref: str) -> Optional[str]:
+    # Lenovo & Dell monitors/accessories: prefer description, else part number
+    return _generic_from_description(_clean_caps(desc)) or (part or None)
+
+def _extract_hp_monitor(desc: str, part: str, ref: str) -> Optional[str]:
+    # HP monitor: ID in description (often with '#')
+    s = _clean_caps(desc)
+    return _find_hp_monitor_id(s) or _find_parenthetical_id(s) or _find_dell_model_like(s)
+
+def _extract_parenthetical(desc: str, part: str, ref: str) -> Optional[str]:
+    # Parentheses model in description, like (9M9D7AT); the generic lookup
+    # already tries the parentheses first, so it is not scanned twice
+    return _generic_from_description(_clean_caps(desc))
+
+def _extract_comma_phrase(desc: str, part: str, ref: str) -> Optional[str]:
+    # No headers: take phrase before first comma
+    return _phrase_before_first_comma(desc) or _generic_from_description(_clean_caps(desc))
+
+def _extract_default(desc: str, part: str, ref: str) -> Optional[str]:
+    return _generic_from_description(_clean_caps(desc)) or (part or ref or None)
+
+def _pick_strategy(sname: str) -> Callable[[str, str, str], Optional[str]]:
+    # sname is the sheet name already passed through _clean_caps; the sheet
+    # decides the strategy once so rows skip the sheet-name checks
     if "UPS" in sname:
-        return ref or None
+        return _extract_ups
 
-    # Microsoft & ASUS: prefer description, else part number
     if "MICROSOFT" in sname or "ASUS" in sname:
-        return _generic_from_description(desc) or (part if part and part.upper() != "NEW" else None)
+        return _extract_microsoft_asus
 
-    # Lenovo notebook & option: prefer description, else part number
-    if "LENOVO" in sname and ("NOTEBOOK" in sname or "OPTION" in sname):
-        return _generic_from_description(desc) or (part or None)
-
-    # Lenovo PCs/AIO/Workstation/Monitor: prefer description, else part number
+    # Lenovo notebooks/options and PCs/AIO/Workstation/Monitor
     if "LENOVO" in sname:
-        return _generic_from_description(desc) or (part or None)
+        return _extract_desc_then_part
 
-    # HP monitor: ID in description (often with '#')
     if "HP" in sname and "MONITOR" in sname:
-        return _find_hp_monitor_id(desc) or _find_parenthetical_id(desc) or _find_dell_model_like(desc)
+        return _extract_hp_monitor
 
-    # HP servers & parts: parentheses in description
+    # HP servers & parts
     if "HP" in sname and ("SERVER" in sname or "PART" in sname):
-        return _find_parenthetical_id(desc) or _generic_from_description(desc)
+        return _extract_parenthetical
 
-    # HP notebooks/workstation/option (no headers): take phrase before first comma
+    # HP notebooks/workstation/option
     if "HP" in sname and any(x in sname for x in ("NOTEBOOK","WORKSTATION","OPTION")):
-        return _phrase_before_first_comma(desc) or _generic_from_description(desc)
+        return _extract_comma_phrase
 
-    # HP PCs/AIO/Workstation (no headers), parentheses style like (9M9D7AT)
+    # HP PCs/AIO/Workstation
     if "HP" in sname and any(x in sname for x in ("PCS","AIO","WORKSTATION")):
-        return _find_parenthetical_id(desc) or _generic_from_description(desc)
+        return _extract_parenthetical
 
     # Dell monitors & accessories: from description
     if "DELL" in sname and (("MONITOR" in sname) or ("ACCESSOR" in sname)):
-        return _generic_from_description(desc) or (part or None)
+        return _extract_desc_then_part
 
     # Consumer + AIO + Gaming: parentheses model
     if any(x in sname for x in ("CONSUMER","AIO","GAMING")):
-        return _find_parenthetical_id(desc) or _generic_from_description(desc)
+        return _extract_parenthetical
 
-    # Default
-    return _generic_from_description(desc) or (part or ref or None)
-def run_on_excel_file(excel_file_path: str, output_file: str = "output_results.xlsx"):
-    # Load all sheets
-    xls = pd.read_excel(excel_file_path, sheet_name=None, dtype=str, engine="openpyxl")
-    writer = pd.ExcelWriter(output_file, engine='openpyxl')
+    return _extract_default
 
-    for sheet_name, df in xls.items():
-        print(f"Processing sheet: {sheet_name}")
-        df.fillna("", inplace=True)
+@lru_cache(maxsize=65536)
+def _extract_cached(strategy: Callable[[str, str, str], Optional[str]], desc: str, part: str, ref: str) -> Optional[str]:
+    # Price lists repeat descriptions across SKUs of one base model, so
+    # identical cells under the same strategy are only extracted once
+    return strategy(desc, part, ref)
 
-        # Apply the extraction function row by row
-        def process_row(row: pd.Series) -> Optional[str]:
-            return extract_product_id_for_row(sheet_name, row.to_dict())
+def extract_product_id_for_row(sheet_name: str, row: Dict[str, Any]) -> Optional[str]:
+    desc_idx, part_idx, ref_idx = _resolve_columns(tuple(row.keys()))
+    values = list(row.values())
+    desc = values[desc_idx] if desc_idx is not None else None
+    part = values[part_idx] if part_idx is not None else None
+    ref = values[ref_idx] if ref_idx is not None else None
+
+    # Raw rows (e.g. openpyxl values) hold None for empty cells; fall back
+    # to the first/second cells by value, not only when a label is missing
+    if desc is None:
+        desc = row[0] if 0 in row else (values[0] if values else None)
+    if part is None and 1 in row:
+        part = row[1]
+    if ref is None and "REF" in row:
+        ref = row["REF"]
+
+    strategy = _pick_strategy(_clean_caps(sheet_name))
+    return _extract_cached(strategy, _text(desc), _text(part), _text(ref))
+
+def _process_sheet(item: Tuple[str, pd.DataFrame]) -> Tuple[str, pd.DataFrame]:
+    sheet_name, df = item
+    print(f"Processing sheet: {sheet_name}")
+    df.fillna("", inplace=True)
+
+    # Resolve sheet name and columns once, then walk plain row tuples
+    strategy = _pick_strategy(_clean_caps(sheet_name))
+    desc_idx, part_idx, ref_idx = _resolve_columns(tuple(df.columns))
+    df["EXTRACTED_PRODUCT_ID"] = [
+        _extract_cached(strategy, _cell(t, desc_idx), _cell(t, part_idx), _cell(t, ref_idx))
+        for t in df.itertuples(index=False, name=None)
+    ]
+    return sheet_name, df
+
+def run_on_excel_file(excel_file_path: str, output_file: str = "output_results.xlsx"):
+    # Load all sheets as Arrow-backed strings (needs pyarrow)
+    xls = pd.read_excel(excel_file_path, sheet_name=None, dtype="string[pyarrow]", engine="openpyxl")
+    # constant_memory is left off: pandas writes cells column by column,
+    # which that row-streaming mode silently drops
+    writer = pd.ExcelWriter(output_file, engine='xlsxwriter', engine_kwargs={'options': {'strings_to_urls': False}})
 
-        df["EXTRACTED_PRODUCT_ID"] = df.apply(process_row, axis=1)
+    for item in xls.items():
+        sheet_name, df = _process_sheet(item)
 
         # Write to output Excel file
         df.to_excel(writer, sheet_name=sheet_name, index=False)
 
-    writer._save()
-    print(f"\n✅ Done! Results saved to {"final_merged.csv"}")
+    writer.close()
+    print(f"\n✅ Done! Results saved to {output_file}")
 
 # === Entry Point ===
 